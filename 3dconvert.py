@@ -1,23 +1,32 @@
 
 #Conversion of openpose 2D coordinates to 3D camera coordinates
-#- Loads a recorded .bag file from an Intel RealSense camera.
+#- Loads a recorded .bag file from an Intel RealSense camera, or the camera metadata sidecar
+#  and depth cache written by extract.py (no librealsense needed).
 #- Aligns depth frames to the color stream.
-#- Loads corresponding OpenPose 2D keypoints.
+#- Gets 2D keypoints from a pose backend: OpenPose JSON files, or detection run in-process on the decoded frames.
+#- Keeps only the keypoint groups downstream stages need (model and kept ids stored on the first frame).
 #- Uses camera intrinsics and depth data to convert 2D keypoints to 3D.
-#- Saves the 3D keypoints for all frames into a single JSON file.
+#- Saves the 3D keypoints for all frames into a single JSON file, and the 2D keypoints
+#  next to it as keypoints_2d.npz so later stages do not run detection again.
 
 
 
 
-import pyrealsense2 as rs
 import numpy as np
 import json
 import os
 
 import sys
-bag_file = sys.argv[1]            # path to .bag file
-openpose_json_dir = sys.argv[2]   # path to OpenPose json directory
+import skeletons
+import pose_backends
+import recording
+recording_path = sys.argv[1]      # path to .bag file, or extract.py output folder
+pose_source = sys.argv[2]         # OpenPose json directory, or a pose model / "stub" (see pose_backends.py)
 output_3d_path = sys.argv[3]    
+# OpenPose model of the keypoints, "auto" lets the pose source decide (model files know their model)
+model_pose = sys.argv[4] if len(sys.argv) > 4 and sys.argv[4] != "auto" else None
+# comma separated keypoint groups, defaults to what plotvideo.py and limbgraph.py need
+keypoint_groups = tuple(sys.argv[5].split(",")) if len(sys.argv) > 5 else skeletons.pipeline_groups()
 
 # INPUT PATHS 
 #bag_file = r"C:\Users\hp\Documents\20250606_132745.bag" 
@@ -27,121 +36,107 @@ output_3d_path = sys.argv[3]
 # Make sure output folder exists 
 os.makedirs(os.path.dirname(output_3d_path), exist_ok=True)
 
-# RealSense setup
-pipeline = rs.pipeline()
-config = rs.config()
-config.enable_device_from_file(bag_file, repeat_playback=False)
-profile = pipeline.start(config)
+# 2D keypoint source
+backend = pose_backends.create_backend(pose_source, model_pose)
+model_pose = backend.model_pose
 
-# Extract camera intrinsics for deprojection
-color_stream = profile.get_stream(rs.stream.color)
-video_profile = color_stream.as_video_stream_profile()
-intrinsics = video_profile.get_intrinsics()
+# Precompile the keypoint selection (original OpenPose indices to keep)
+keypoint_ids, _ = skeletons.compile_selection(model_pose, keypoint_groups)
+print(f"Model {model_pose}: keeping {len(keypoint_ids)} keypoints for groups {', '.join(keypoint_groups)}")
+
+# Frames and calibration, from the bag or from the extract.py sidecar + depth cache
+camera = recording.Recording(recording_path)
+
+# Camera intrinsics for deprojection (depth is aligned to color)
+intrinsics = camera.intrinsics
 print("Camera Intrinsics:", intrinsics.fx, intrinsics.fy, intrinsics.ppx, intrinsics.ppy)
 
 # Get depth scale (convert depth units to meters)
-depth_sensor = profile.get_device().first_depth_sensor()
-depth_scale = depth_sensor.get_depth_scale()
+depth_scale = camera.depth_scale
 print("Depth Scale:", depth_scale)
 
-# Align depth to color frame
-align_to = rs.stream.color
-align = rs.align(align_to)
-
-# Define filters
-'''
-Spatial reduces noise in the depth image by smoothing neighboring pixels, especially around edges.
-Temporal reduces flickering or inconsistent depth values over time (across frames)
-Hole filling fill missing holes with estimated values from surrounding pixels, making the depth image more complete.
-for more: https://dev.intelrealsense.com/docs/post-processing-filters
-'''
-spatial = rs.spatial_filter()
-#temporal = rs.temporal_filter()
-#hole_filling = rs.hole_filling_filter()
-
-# Playback control for bag file 
-playback = profile.get_device().as_playback()
-playback.set_real_time(False)
-
-# Get sorted list of OpenPose JSON files 
-json_files = sorted(
-    [f for f in os.listdir(openpose_json_dir) if f.endswith('.json')],
-    key=lambda x: int(''.join(filter(str.isdigit, x)))
-)
+# Deprojection ray of every pixel, computed once
+rays = recording.pixel_rays(intrinsics)
+
 # Store 3D keypoints for each frame
 all_frames_3d = []
-frame_idx = 0
 
-try:
-    for json_file in json_files:
-        frames = pipeline.wait_for_frames()
-        if not frames:
-            print("No more frames from bag.")
-            break
+# 2D keypoints of every frame read from the recording (empty for skipped frames)
+keypoints_2d = []
+
+# Frames waiting for a batched detection: (recording frame index, color image, depth image)
+pending = []
+
+
+def convert_frame(depth_image, people):
+    # Deproject the selected keypoints of every person, flattened as [person0 keypoints, person1 keypoints, ...]
+    keypoints_3d_all_people = []
+
+    for keypoints in people:
+        keypoints = keypoints[keypoint_ids]
+
+        u = keypoints[:, 0].astype(int)  # X coordinate
+        v = keypoints[:, 1].astype(int)  # Y coordinate
+        confidence = keypoints[:, 2]
 
-        # Align depth frame to color frame
-        aligned_frames = align.process(frames)
-        depth_frame = aligned_frames.get_depth_frame()
-        color_frame = aligned_frames.get_color_frame()
-
-        # Skip frames missing either stream
-        if not depth_frame or not color_frame:
-            print("Skipping frame, missing depth or color frame.")
-            continue
-
-        # Apply filters to depth frame
-        depth_frame = spatial.process(depth_frame)
-        #depth_frame = temporal.process(depth_frame)
-        #depth_frame = hole_filling.process(depth_frame)
-
-        # Convert depth frame to numpy array (depth in raw units)
-        depth_image = np.asanyarray(depth_frame.get_data())
-
-        # Load OpenPose 2D keypoints JSON for current frame
-        with open(os.path.join(openpose_json_dir, json_file), 'r') as f:
-            pose_data = json.load(f)
-
-        people = pose_data.get("people", [])
-        keypoints_3d_all_people = []
-
-        for person in people:
-            keypoints = person.get("pose_keypoints_2d", [])
-
-            # keypoints is flat list [x1, y1, c1, x2, y2, c2, ...]
-            for i in range(0, len(keypoints), 3):
-                u = int(keypoints[i])  # X coordinate
-                v = int(keypoints[i + 1])  # Y coordinate
-                confidence = keypoints[i + 2]
-               
-                # Skip low-confidence or out-of-bounds points
-                if confidence < 0.1 or not (0 <= u < intrinsics.width and 0 <= v < intrinsics.height):
-                    keypoints_3d_all_people.append([None, None, None])
-                    continue
-
-                # Get depth value in meters
-                z = depth_image[v, u] * depth_scale
-                if z == 0:
-                    keypoints_3d_all_people.append([None, None, None])
-                    continue
-
-                # Deproject 2D pixel to 3D point in space
-                X, Y, Z = rs.rs2_deproject_pixel_to_point(intrinsics, [u, v], z)
-                keypoints_3d_all_people.append([X, Y, Z])
-
-        # Save frame data
-        all_frames_3d.append({
-            "frame": frame_idx,
-            "keypoints_3d": keypoints_3d_all_people
-        })
-
-        frame_idx += 1
-
-        if playback.current_status == rs.playback_status.stopped:
-            print("Playback ended.")
+        # Skip low-confidence or out-of-bounds points
+        valid = (confidence >= 0.1) & (0 <= u) & (u < intrinsics.width) & (0 <= v) & (v < intrinsics.height)
+
+        # Get depth values in meters, skip points without depth
+        z = np.zeros(len(keypoints))
+        z[valid] = depth_image[v[valid], u[valid]] * depth_scale
+        valid &= z != 0
+
+        # Deproject 2D pixels to 3D points in space
+        points = (rays[:, np.where(valid, v, 0), np.where(valid, u, 0)] * z).T.tolist()
+        for k in range(len(keypoints)):
+            keypoints_3d_all_people.append(points[k] if valid[k] else [None, None, None])
+
+    return keypoints_3d_all_people
+
+
+def process_pending():
+    # Detect keypoints for the buffered frames in one batch and convert them
+    if not pending:
+        return
+    people_batch = backend.detect([color_image for _, color_image, _ in pending])
+    for (frame_idx, _, depth_image), people in zip(pending, people_batch):
+        keypoints_2d.append(people)
+
+        # Save frame data, the model and kept keypoint ids only once on the first frame
+        frame_data = {"frame": frame_idx}
+        if not all_frames_3d:
+            frame_data["model"] = model_pose
+            frame_data["keypoint_ids"] = keypoint_ids.tolist()
+        frame_data["keypoints_3d"] = convert_frame(depth_image, people)
+        all_frames_3d.append(frame_data)
+    pending.clear()
+
+
+try:
+    frames_read = 0
+    for color_image, depth_image in camera.frames(need_color=backend.needs_images):
+        # Stop when the backend has no more keypoints (e.g. last OpenPose JSON file)
+        if backend.num_frames is not None and frames_read >= backend.num_frames:
             break
+        frame_idx = frames_read   # frame index in the recording, shared with pointcloud.py
+        frames_read += 1
+
+        # Frame missing either stream
+        if depth_image is None:
+            # Detect what is buffered first, so frames stay in order
+            process_pending()
+            backend.skip()
+            keypoints_2d.append(backend.no_people())
+        else:
+            pending.append((frame_idx, color_image, depth_image))
+            if len(pending) >= backend.batch_size:
+                process_pending()
+
+    process_pending()
 
 finally:
-    pipeline.stop()
+    camera.close()
     print("Processing done.")
 
 # Save all frames data into single JSON file
@@ -149,3 +144,8 @@ with open(output_3d_path, "w") as f:
     json.dump(all_frames_3d, f, indent=2)
 
 print(f"Saved all frames to: {output_3d_path}")
+
+# Save 2D keypoints for later stages (pointcloud.py)
+keypoints_2d_path = os.path.join(os.path.dirname(output_3d_path), pose_backends.KEYPOINTS_2D_FILE)
+pose_backends.save_keypoints_array(keypoints_2d_path, keypoints_2d, model_pose)
+print(f"Saved 2D keypoints to: {keypoints_2d_path}")
@@ -2,7 +2,10 @@
 #RealSense .bag File Color and Depth Extraction
 #- Extract color and depth frames
 #- Convert and visualize the depth data using a colormap
-#- Save two separate `.mp4` video files
+#- Save two separate `.mp4` video files (the color one is skipped with --no-color-video,
+#  when pose detection runs in-process and nothing reads it)
+#- Save the camera metadata sidecar (intrinsics, extrinsics, depth scale, streams, serial)
+#  and the depth aligned to color as a cache, so later stages never reopen the .bag
 
 import pyrealsense2 as rs
 import cv2
@@ -10,9 +13,11 @@ import os
 import numpy as np
 
 import sys
+import recording
 
 bag_path = sys.argv[1]
 output_path = sys.argv[2]
+write_color_video = "--no-color-video" not in sys.argv[3:]
 
 # Paths
 BAG_PATH = bag_path
@@ -25,7 +30,8 @@ OUTPUT_COLOR_VIDEO = os.path.join(OUTPUT_PATH, "color_output.avi")
 OUTPUT_DEPTH_VIDEO = os.path.join(OUTPUT_PATH, "depth_output.avi")
 
 #prints path
-print(f"Output color video: {OUTPUT_COLOR_VIDEO}")
+if write_color_video:
+    print(f"Output color video: {OUTPUT_COLOR_VIDEO}")
 print(f"Output depth video: {OUTPUT_DEPTH_VIDEO}")
 
 #  Start RealSense Pipeline
@@ -49,13 +55,57 @@ fps = int(color_stream.as_video_stream_profile().fps())
 
 print(f"Stream resolution: {video_width}x{video_height} @ {fps} FPS")
 
+# Camera metadata for the sidecar
+depth_stream = profile.get_stream(rs.stream.depth)
+depth_video_profile = depth_stream.as_video_stream_profile()
+depth_to_color = depth_stream.get_extrinsics_to(color_stream)
+serial = device.get_info(rs.camera_info.serial_number) if device.supports(rs.camera_info.serial_number) else None
+
+metadata = {
+    "device_serial": serial,
+    # Later stages decode color from here instead of color_output.avi (lossless, no depth/align work)
+    "bag_file": os.path.abspath(bag_path),
+    "depth_scale": device.first_depth_sensor().get_depth_scale(),
+    "color": {
+        "width": video_width,
+        "height": video_height,
+        "fps": fps,
+        "format": str(color_stream.format()).split(".")[-1],
+        "intrinsics": recording.intrinsics_from_rs(color_stream.as_video_stream_profile().get_intrinsics()).to_dict(),
+    },
+    "depth": {
+        "width": depth_video_profile.width(),
+        "height": depth_video_profile.height(),
+        "fps": int(depth_video_profile.fps()),
+        "format": str(depth_stream.format()).split(".")[-1],
+        "intrinsics": recording.intrinsics_from_rs(depth_video_profile.get_intrinsics()).to_dict(),
+    },
+    # rotation is 3x3 column-major, translation in meters
+    "depth_to_color": {
+        "rotation": list(depth_to_color.rotation),
+        "translation": list(depth_to_color.translation),
+    },
+    # Cached depth is aligned to color, so it is deprojected with the color intrinsics
+    "depth_cache": {
+        "directory": recording.DEPTH_CACHE_DIR,
+        "aligned_to": "color",
+        "filters": ["spatial"],
+        "frames": 0,
+    },
+}
+
+# Align depth to color and filter it the same way 3dconvert.py does for the depth cache
+align = rs.align(rs.stream.color)
+spatial = rs.spatial_filter()
+depth_cache = recording.DepthCacheWriter(OUTPUT_PATH)
+
 # Initialize video writers
 fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-color_out = cv2.VideoWriter(OUTPUT_COLOR_VIDEO, fourcc, fps, (video_width, video_height))
+color_out = cv2.VideoWriter(OUTPUT_COLOR_VIDEO, fourcc, fps, (video_width, video_height)) if write_color_video else None
 depth_out = cv2.VideoWriter(OUTPUT_DEPTH_VIDEO, fourcc, fps, (video_width, video_height))
 
 # Checks if video writers opened successfully
-if not color_out.isOpened() or not depth_out.isOpened():
+if (color_out is not None and not color_out.isOpened()) or not depth_out.isOpened():
     print("Error: Could not open one or both video writers.")
     pipeline.stop()
     exit(1)
@@ -101,9 +151,10 @@ try:
         last_timestamp = timestamp
 
         # Convert and write color 
-        color_image = np.asanyarray(color_frame.get_data())
-        color_image = cv2.cvtColor(color_image, cv2.COLOR_RGB2BGR) # Convert to BGR for OpenCV
-        color_out.write(color_image)
+        if color_out is not None:
+            color_image = np.asanyarray(color_frame.get_data())
+            color_image = cv2.cvtColor(color_image, cv2.COLOR_RGB2BGR) # Convert to BGR for OpenCV
+            color_out.write(color_image)
 
         # Convert and write depth 
         depth_image = np.asanyarray(depth_frame.get_data())
@@ -113,6 +164,14 @@ try:
         )
         depth_out.write(depth_colormap)
 
+        # Cache depth aligned to color (raw units)
+        aligned_depth = align.process(frames).get_depth_frame()
+        if aligned_depth:
+            depth_cache.add(np.asanyarray(spatial.process(aligned_depth).get_data()), timestamp)
+        else:
+            print(f"No aligned depth at index {frame_idx}, caching empty depth.")
+            depth_cache.add(np.zeros((video_height, video_width), np.uint16), timestamp)
+
         if frame_idx % 50 == 0:
             print(f"Writing frame {frame_idx}")
 
@@ -123,11 +182,17 @@ except Exception as e:
 
 finally:
     pipeline.stop()
-    color_out.release()
+    if color_out is not None:
+        color_out.release()
     depth_out.release()
     cv2.destroyAllWindows()
-    print(f"Color video: {OUTPUT_COLOR_VIDEO}")
+    depth_cache.close()
+    metadata["depth_cache"]["frames"] = depth_cache.num_frames
+    metadata_path = recording.save_metadata(OUTPUT_PATH, metadata)
+    if color_out is not None:
+        print(f"Color video: {OUTPUT_COLOR_VIDEO}")
     print(f"Depth video: {OUTPUT_DEPTH_VIDEO}")
+    print(f"Camera metadata: {metadata_path}")
 
 
 
@@ -1,7 +1,7 @@
 '''
 3D Limb distances graph
 - Loads 3D pose keypoints from a JSON file
-- Define limb connections (body and hands).
+- Takes limb connections (arm and shoulder limbs, hands and wrist to finger tip spans) from the shared skeleton registry.
 - Calculates per frame distance changes (dx, dy, dz, and Euclidean) for each limb.
 - Saves the distance data as a new JSON file.
 - Generates and saves plots showing how each limb’s distance changes across frames.
@@ -12,12 +12,14 @@ import numpy as np
 import json
 import os
 import matplotlib.pyplot as plt
+import skeletons
 
 
 import sys
 input_path = sys.argv[1]          # input 3d.json
 json_output_path = sys.argv[2]    # output limb_distances.json
 plot_output_dir = sys.argv[3]     # directory to save plots
+model_arg = sys.argv[4] if len(sys.argv) > 4 else None   # OpenPose model, defaults to the one stored in the JSON
 
 
 # Load your input JSON file 
@@ -26,32 +28,19 @@ plot_output_dir = sys.argv[3]     # directory to save plots
 with open(input_path, "r") as f:
     data = json.load(f)  # This is a list of frames
 
-#  Define the limb pairs (by keypoint indices)
-left_hand_pairs = [
-    (25, 26), (26, 27), (27, 28),          
-    (29, 30), (30, 31), (31, 32),          
-    (33, 34), (34, 35), (35, 36),          
-    (37, 38), (38, 39), (39, 40),          
-    (41, 42), (42, 43), (43, 44),          
-    (9, 25), (9, 29), (9, 33), (9, 41), (9, 37)    # Wrist to finger base connections
-]
-
-
-# Right Hand (45–64)
-right_hand_pairs = [
-    (45, 46), (46, 47), (47, 48),                
-    (49, 50), (50, 51), (51, 52),        
-    (53, 54), (54, 55), (55, 56),        
-    (57, 58), (58, 59), (59, 60),       
-    (61, 62), (62, 63), (63, 64),
-    (10,45),(10,49), (10,53), (10,61),(10,57)   # Wrist to finger base connections
-]       
-
-
-limb_pairs = [
-    (5, 7), (5, 11),(5, 17), (6, 8),(6, 12),(6, 17), (7, 9), (8, 10), 
-    (10, 48), (10, 52), (10, 56), (10, 60), (10, 64),(9,28),(9,32),(9,36),(9,40),(9,44)
-] + left_hand_pairs + right_hand_pairs
+# OpenPose model recorded by 3dconvert.py (files without one are BODY_135)
+MODEL = model_arg or (data[0].get("model") if data else None) or "BODY_135"
+
+#  Limb pairs (by keypoint indices) from the skeleton registry
+keypoint_ids, connections = skeletons.compile_selection(MODEL, skeletons.STAGE_GROUPS["limbgraph"])
+num_keypoints = skeletons.SKELETONS[MODEL]["num_keypoints"]
+limb_pairs = [tuple(pair) for pair in connections.tolist()]
+
+# Position of each keypoint index in the sampled keypoints
+positions = skeletons.position_lookup(keypoint_ids)
+
+# Keypoint ids stored in the JSON (written once on its first frame)
+stored_ids = skeletons.stored_keypoint_ids(data, num_keypoints)
 
 # Process distances for each frame 
 all_distances = []
@@ -80,18 +69,19 @@ for frame_data in data:
     frame_idx = frame_data["frame"]
     if not (frame_start <= frame_idx <= frame_end):
         continue # Skip frames outside range
-    keypoints = np.array(frame_data["keypoints_3d"])  # Shape: (num_keypoints, 3)
+    # Selected keypoints ordered as keypoint_ids, shape: (len(keypoint_ids), 3) per person
+    keypoints = skeletons.sample_frame(frame_data, keypoint_ids, stored_ids)
     frame_result = {"frame": frame_idx, "limbs": {}}
 
     # Process each limb pair
     for kp1, kp2 in limb_pairs:
         try:
-            pt1 = keypoints[kp1]
-            pt2 = keypoints[kp2]
+            pt1 = keypoints[positions[kp1]]
+            pt2 = keypoints[positions[kp2]]
         except IndexError:
             continue # Skip if keypoint index out of range
 
-        if pt1 is None or pt2 is None:
+        if None in pt1 or None in pt2:
             continue # Skip if missing keypoints
 
         pt1 = np.array(pt1, dtype=np.float64)
@@ -1,10 +1,20 @@
 import os
 import subprocess
 import sys
+import skeletons
 
 # --- Define Python executable from venv ---
 REALSENSE_PYTHON = os.path.abspath("realsense-env\\Scripts\\python.exe")
 
+# --- OpenPose model for OpenPoseDemo.exe and the keypoint groups later stages need (see skeletons.py) ---
+MODEL_POSE = "BODY_135"
+KEYPOINT_GROUPS = ",".join(skeletons.pipeline_groups())
+
+# --- Pose backend: "openpose" runs OpenPoseDemo.exe on the color video and reads its JSON output,
+# anything else is passed to the stages as an in-process pose source (model file or "stub", see pose_backends.py),
+# which then decides the model itself ---
+POSE_BACKEND = "openpose"
+
 # --- Step 1: Ask for bag file path ---
 bag_path = input("Enter path to .bag file: ").strip().strip('"')
 if not os.path.isfile(bag_path) or not bag_path.endswith(".bag"):
@@ -21,39 +31,56 @@ os.makedirs(output_dir, exist_ok=True)
 color_output = os.path.join(output_dir, "color_output.avi")
 depth_output = os.path.join(output_dir, "depth_output.avi")
 json_output_dir = os.path.join(output_dir, "json")
-os.makedirs(json_output_dir, exist_ok=True)
 openpose_result = os.path.join(output_dir, "result.avi")
 keypoints_3d_json = os.path.join(output_dir, "3d.json")
+keypoints_2d_file = os.path.join(output_dir, "keypoints_2d.npz")   # written by 3dconvert.py
 plot_output_html = os.path.join(output_dir, "plot.html")
 limb_json = os.path.join(output_dir, "limb_distances.json")
 limb_graph_dir = os.path.join(output_dir, "limb_graph")
 os.makedirs(limb_graph_dir, exist_ok=True)
+pointcloud_dir = os.path.join(output_dir, "pointcloud")
 
-# --- Step 3: Run extract.py ---
-print("\n[1/5] Extracting video from .bag ...")
-subprocess.run([REALSENSE_PYTHON, "extract.py", bag_path, output_dir])
+# --- Step 3: Run extract.py (the color video is only needed by OpenPoseDemo.exe) ---
+print("\n[1/6] Extracting video from .bag ...")
+extract_flags = [] if POSE_BACKEND == "openpose" else ["--no-color-video"]
+subprocess.run([REALSENSE_PYTHON, "extract.py", bag_path, output_dir] + extract_flags)
 
 # --- Step 4: Run OpenPose ---
-print("\n[2/5] Running OpenPose ...")
-subprocess.run([
-    "build\\x64\\Release\\OpenPoseDemo.exe",
-    "--video", color_output,
-    "--write_json", json_output_dir,
-    "--write_video", openpose_result,
-    "--model_pose", "BODY_135",
-    #"--render_pose", "0"
-])
-
-# --- Step 5: Run 3dconvert.py ---
-print("\n[3/5] Converting to 3D coordinates ...")
-subprocess.run([REALSENSE_PYTHON, "3dconvert.py", bag_path, json_output_dir, keypoints_3d_json])
-
-# --- Step 6: Run plotvideo.py (can use system Python) ---
-print("\n[4/5] Plotting 3D animation ...")
+if POSE_BACKEND == "openpose":
+    print("\n[2/6] Running OpenPose ...")
+    os.makedirs(json_output_dir, exist_ok=True)
+    subprocess.run([
+        "build\\x64\\Release\\OpenPoseDemo.exe",
+        "--video", color_output,
+        "--write_json", json_output_dir,
+        "--write_video", openpose_result,
+        "--model_pose", MODEL_POSE,
+        #"--render_pose", "0"
+    ])
+    pose_source = json_output_dir
+    stage_model = MODEL_POSE
+    stage_python = "python"
+else:
+    print("\n[2/6] Pose detection runs in-process with", POSE_BACKEND)
+    pose_source = POSE_BACKEND
+    stage_model = "auto"
+    # Color for in-process detection is decoded from the bag (color stream only), so pyrealsense2 is needed
+    stage_python = REALSENSE_PYTHON
+
+# --- Step 5: Run 3dconvert.py on the metadata sidecar and depth cache written by extract.py ---
+print("\n[3/6] Converting to 3D coordinates ...")
+subprocess.run([stage_python, "3dconvert.py", output_dir, pose_source, keypoints_3d_json, stage_model, KEYPOINT_GROUPS])
+
+# --- Step 6: Run pointcloud.py on the 2D keypoints saved by 3dconvert.py and the depth cache (can use system Python) ---
+print("\n[4/6] Exporting person point clouds ...")
+subprocess.run(["python", "pointcloud.py", output_dir, keypoints_2d_file, pointcloud_dir])
+
+# --- Step 7: Run plotvideo.py (can use system Python) ---
+print("\n[5/6] Plotting 3D animation ...")
 subprocess.run(["python", "plotvideo.py", keypoints_3d_json, plot_output_html])
 
-# --- Step 7: Run limbgraph.py (can use system Python) ---
-print("\n[5/5] Drawing limb distance graphs ...")
+# --- Step 8: Run limbgraph.py (can use system Python) ---
+print("\n[6/6] Drawing limb distance graphs ...")
 subprocess.run(["python", "limbgraph.py", keypoints_3d_json, limb_json, limb_graph_dir])
 
 print("\n All steps completed! Results saved in:", output_dir)
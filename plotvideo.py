@@ -1,7 +1,8 @@
 '''
 Plots 3D coordinates as animation
 - Loads 3D keypoints from a JSON file.
-- Defines connection pairs for body, left hand, and right hand.
+- Takes connection pairs for body, left hand, and right hand from the shared skeleton registry.
+- Samples only the keypoints of those groups from each frame.
 - Visualizes the pose data as a 3D animation using Plotly.
 - Adds interactive slider and play/pause controls.
 - Saves the animation as an HTML file.
@@ -11,59 +12,35 @@ import json
 import plotly.graph_objects as go
 
 import sys
+import skeletons
 
 input_3d_json = sys.argv[1]   # 3D keypoints JSON
 output_html = sys.argv[2]    
-
-# Constants and Keypoint Offsets
-H135 = 25   # Starting index of left hand keypoints
-F135 = 65   # Face keypoints start index
-
-# Connection pairs
-body_connections = [
-    (0, 17), 
-    (0, 1), (1, 3),
-    (0, 2), (2, 4),
-    (17, 5), (5, 7), (7, 9),
-    (17, 6), (6, 8), (8, 10),
-    (5, 11), (6, 12),
-    (13, 15), (14, 16),
-    (15, 19), (19, 20), (15, 21),
-    (16, 22), (22, 23), (16, 24)
-]
-
-left_hand_connections = [
-    (9, 25), (25, 26), (26, 27), (27, 28),
-    (9, 29), (29, 30), (30, 31), (31, 32),
-    (9, 33), (33, 34), (34, 35), (35, 36),
-    (9, 37), (37, 38), (38, 39), (39, 40),
-    (9, 41), (41, 42), (42, 43), (43, 44)
-]
-
-right_hand_connections = [
-    (10, H135+20), (H135+20, H135+21), (H135+21, H135+22), (H135+22, H135+23),
-    (10, H135+24), (H135+24, H135+25), (H135+25, H135+26), (H135+26, H135+27),
-    (10, H135+28), (H135+28, H135+29), (H135+29, H135+30), (H135+30, H135+31),
-    (10, H135+32), (H135+32, H135+33), (H135+33, H135+34), (H135+34, H135+35),
-    (10, H135+36), (H135+36, H135+37), (H135+37, H135+38), (H135+38, H135+39)
-]
-# Optional
-#face_contour_connections = [(F135 + i, F135 + i + 1) for i in range(16)]
-
-connections = body_connections + left_hand_connections + right_hand_connections 
-#+ face_contour_connections
+model_arg = sys.argv[3] if len(sys.argv) > 3 else None   # OpenPose model, defaults to the one stored in the JSON
 
 # Load JSON keypoints frames
 with open(input_3d_json, 'r') as f:
     data = json.load(f)
 
+# OpenPose model recorded by 3dconvert.py (files without one are BODY_135)
+MODEL = model_arg or (data[0].get("model") if data else None) or "BODY_135"
+
+# Keypoint groups plotted (see skeletons.py)
+keypoint_ids, connections = skeletons.compile_selection(MODEL, skeletons.STAGE_GROUPS["plotvideo"])
+num_keypoints = skeletons.SKELETONS[MODEL]["num_keypoints"]
 
-frames_data = [frame_obj['keypoints_3d'] for frame_obj in data]
+# Connection pairs as positions in the sampled keypoints
+local_connections = skeletons.position_lookup(keypoint_ids)[connections].tolist()
+
+stored_ids = skeletons.stored_keypoint_ids(data, num_keypoints)
+frames_data = [skeletons.sample_frame(frame_obj, keypoint_ids, stored_ids) for frame_obj in data]
 
 def get_lines_coords(keypoints, pairs):
-    #Generate line coordinates (x, y, z) from keypoint index pairs for Plotly 3D lines.
+    #Generate line coordinates (x, y, z) from keypoint position pairs for Plotly 3D lines, repeated for every person.
     xs, ys, zs = [], [], []
-    for i, j in pairs:
+    n = len(keypoint_ids)
+    person_pairs = [(i + p * n, j + p * n) for p in range(len(keypoints) // n) for i, j in pairs]
+    for i, j in person_pairs:
         if i < len(keypoints) and j < len(keypoints):
             x0, y0, z0 = keypoints[i]
             x1, y1, z1 = keypoints[j]
@@ -73,20 +50,24 @@ def get_lines_coords(keypoints, pairs):
     return xs, ys, zs
 
 def get_keypoint_labels_coords(keypoints):
-    #Extract coordinates and labels for keypoints and returns x, y, z coordinates and string index labels
+    #Extract coordinates and labels for keypoints and returns x, y, z coordinates and OpenPose index labels
     xs = [p[0] for p in keypoints]
     ys = [p[1] for p in keypoints]
     zs = [p[2] for p in keypoints]
-    labels = [str(i) for i in range(len(keypoints))]
+    labels = get_labels(keypoints)
     return xs, ys, zs, labels
 
+def get_labels(keypoints):
+    #String labels with the original OpenPose keypoint index, repeated for every person
+    return [str(keypoint_ids[i % len(keypoint_ids)]) for i in range(len(keypoints))]
+
 # Prepare initial frame
 init_points = frames_data[0]
 x_init = [p[0] for p in init_points]
 y_init = [p[1] for p in init_points]
 z_init = [p[2] for p in init_points]
 
-x_lines, y_lines, z_lines = get_lines_coords(init_points, connections)
+x_lines, y_lines, z_lines = get_lines_coords(init_points, local_connections)
 x_labels, y_labels, z_labels, labels = get_keypoint_labels_coords(init_points)
 
 # Create slider steps
@@ -174,9 +155,9 @@ fig = go.Figure(
                 ),
                 # Limb lines
                 go.Scatter3d(
-                    x=get_lines_coords(frame, connections)[0],
-                    y=get_lines_coords(frame, connections)[1],
-                    z=get_lines_coords(frame, connections)[2],
+                    x=get_lines_coords(frame, local_connections)[0],
+                    y=get_lines_coords(frame, local_connections)[1],
+                    z=get_lines_coords(frame, local_connections)[2],
                     mode='lines',
                     line=dict(color='red', width=3)
                 ),
@@ -186,7 +167,7 @@ fig = go.Figure(
                     y=[p[1] for p in frame],
                     z=[p[2] for p in frame],
                     mode='text',
-                    text=[str(i) for i in range(len(frame))],
+                    text=get_labels(frame),
                     textposition="top center",
                     textfont=dict(color='black', size=14),
                     showlegend=True
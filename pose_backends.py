@@ -0,0 +1,353 @@
+'''
+Pose backends for 2D keypoint detection
+- PoseBackend defines the interface: a batch of RGB frames in, one keypoint array per frame out.
+- Keypoint arrays have shape (num_people, num_keypoints, 3) with OpenPose layout [x, y, confidence].
+- OpenPoseJsonBackend reads the per-frame JSON files written by OpenPoseDemo.exe.
+- ArrayBackend reads the keypoints_2d.npz saved by 3dconvert.py, so detection runs once per session.
+- OpenCVBackend runs the OpenPose Caffe/ONNX model in-process with OpenCV DNN on the CPU.
+- StubBackend returns deterministic keypoints for tests and dry runs.
+cv2 is only imported when an OpenCVBackend is created.
+'''
+
+import json
+import os
+
+import numpy as np
+
+import skeletons
+
+
+class PoseBackend:
+    # Base class, subclasses implement detect()
+    batch_size = 1        # frames the backend prefers per detect() call
+    needs_images = True   # False if detect() ignores the frames (e.g. precomputed JSON)
+    num_frames = None     # number of frames the backend can provide, None if unlimited
+
+    def __init__(self, model_pose):
+        self.model_pose = model_pose
+        self.num_keypoints = skeletons.SKELETONS[model_pose]["num_keypoints"]
+
+    def detect(self, images):
+        # images: list of RGB uint8 arrays (H, W, 3), returns a list of (num_people, num_keypoints, 3) arrays
+        raise NotImplementedError
+
+    def skip(self):
+        # Called for a bag frame that is dropped without detection
+        pass
+
+    def no_people(self):
+        return np.zeros((0, self.num_keypoints, 3))
+
+
+def read_openpose_json(path, num_keypoints):
+    # Load one OpenPose JSON file into a (num_people, num_keypoints, 3) array
+    with open(path, 'r') as f:
+        pose_data = json.load(f)
+    people = []
+    for person in pose_data.get("people", []):
+        keypoints = np.asarray(person.get("pose_keypoints_2d", []), dtype=np.float64).reshape(-1, 3)
+        if len(keypoints) != num_keypoints:
+            print(f"Skipping person with {len(keypoints)} keypoints in {path}, expected {num_keypoints}.")
+            continue
+        people.append(keypoints)
+    if not people:
+        return np.zeros((0, num_keypoints, 3))
+    return np.stack(people)
+
+
+class OpenPoseJsonBackend(PoseBackend):
+    # Keypoints written by OpenPoseDemo.exe --write_json, one file per frame
+    needs_images = False
+
+    def __init__(self, json_dir, model_pose):
+        super().__init__(model_pose)
+        self.json_dir = json_dir
+        # Get sorted list of OpenPose JSON files
+        self.json_files = sorted(
+            [f for f in os.listdir(json_dir) if f.endswith('.json')],
+            key=lambda x: int(''.join(filter(str.isdigit, x)))
+        )
+        self.num_frames = len(self.json_files)
+        self.position = 0
+
+    def detect(self, images):
+        results = []
+        for _ in images:
+            path = os.path.join(self.json_dir, self.json_files[self.position])
+            results.append(read_openpose_json(path, self.num_keypoints))
+            self.position += 1
+        return results
+
+    def skip(self):
+        # Keep the JSON files in step with the bag frames
+        self.position += 1
+
+
+# Part affinity field layout of the OpenPose networks OpenCV DNN can run: keypoint pairs the network
+# connects, and for each pair the x/y PAF channels counted after the heatmaps + background channel
+PAF_LAYOUTS = {
+    "BODY_25": {
+        "pairs": [
+            (1, 8), (1, 2), (1, 5), (2, 3), (3, 4), (5, 6), (6, 7), (8, 9), (9, 10), (10, 11),
+            (8, 12), (12, 13), (13, 14), (1, 0), (0, 15), (15, 17), (0, 16), (16, 18), (2, 17),
+            (5, 18), (14, 19), (19, 20), (14, 21), (11, 22), (22, 23), (11, 24)
+        ],
+        "map_index": [
+            (0, 1), (14, 15), (22, 23), (16, 17), (18, 19), (24, 25), (26, 27), (6, 7), (2, 3), (4, 5),
+            (8, 9), (10, 11), (12, 13), (30, 31), (32, 33), (36, 37), (34, 35), (38, 39), (20, 21),
+            (28, 29), (40, 41), (42, 43), (44, 45), (46, 47), (48, 49), (50, 51)
+        ],
+    },
+    "COCO": {
+        "pairs": [
+            (1, 2), (1, 5), (2, 3), (3, 4), (5, 6), (6, 7), (1, 8), (8, 9), (9, 10), (1, 11),
+            (11, 12), (12, 13), (1, 0), (0, 14), (14, 16), (0, 15), (15, 17), (2, 16), (5, 17)
+        ],
+        "map_index": [
+            (12, 13), (20, 21), (14, 15), (16, 17), (22, 23), (24, 25), (0, 1), (2, 3), (4, 5), (6, 7),
+            (8, 9), (10, 11), (28, 29), (30, 31), (34, 35), (32, 33), (36, 37), (18, 19), (26, 27)
+        ],
+    },
+    "MPI": {
+        "pairs": [
+            (0, 1), (1, 2), (2, 3), (3, 4), (1, 5), (5, 6), (6, 7),
+            (1, 14), (14, 8), (8, 9), (9, 10), (14, 11), (11, 12), (12, 13)
+        ],
+        "map_index": [
+            (0, 1), (2, 3), (4, 5), (6, 7), (8, 9), (10, 11), (12, 13),
+            (14, 15), (16, 17), (18, 19), (20, 21), (22, 23), (24, 25), (26, 27)
+        ],
+    },
+}
+
+
+def output_channels(model_pose):
+    # Heatmaps, background and PAF channels of the network for model_pose
+    return skeletons.SKELETONS[model_pose]["num_keypoints"] + 1 + 2 * len(PAF_LAYOUTS[model_pose]["pairs"])
+
+
+KEYPOINTS_2D_FILE = "keypoints_2d.npz"
+
+
+def save_keypoints_array(path, frames_people, model_pose):
+    # One (num_people, num_keypoints, 3) array per frame read, stored flat with per-frame offsets
+    num_keypoints = skeletons.SKELETONS[model_pose]["num_keypoints"]
+    offsets = np.concatenate(([0], np.cumsum([len(people) for people in frames_people]))).astype(np.int64)
+    keypoints = np.concatenate(frames_people) if frames_people else np.zeros((0, num_keypoints, 3))
+    np.savez_compressed(path, keypoints=keypoints.astype(np.float32), offsets=offsets, model=model_pose)
+
+
+class ArrayBackend(PoseBackend):
+    # Keypoints saved by save_keypoints_array, one entry per frame of the recording
+    needs_images = False
+
+    def __init__(self, path, model_pose=None):
+        with np.load(path) as data:
+            self.keypoints = data["keypoints"].astype(np.float64)
+            self.offsets = data["offsets"]
+            stored_model = str(data["model"])
+        if model_pose is not None and model_pose != stored_model:
+            raise ValueError(f"{path} holds {stored_model} keypoints, not {model_pose}")
+        super().__init__(stored_model)
+        self.batch_size = 64
+        self.num_frames = len(self.offsets) - 1
+        self.position = 0
+
+    def detect(self, images):
+        results = []
+        for _ in images:
+            results.append(self.keypoints[self.offsets[self.position]:self.offsets[self.position + 1]])
+            self.position += 1
+        return results
+
+    def skip(self):
+        self.position += 1
+
+
+class OpenCVBackend(PoseBackend):
+    '''
+    OpenPose network run with OpenCV DNN on the CPU.
+    model_path is the .caffemodel (with config_path the .prototxt) or an .onnx export.
+    The model (BODY_25, COCO or MPI) is found from the network's output channels; a
+    model_pose that does not match them is an error. Frames are batched into one blob
+    net_height pixels high and as wide as the frame aspect allows (OpenPose's -1x368).
+    The heatmaps and part affinity fields are upsampled to that input size, keypoint
+    candidates are the heatmap peaks and are grouped into people with the part
+    affinity fields, as in OpenPose.
+    '''
+
+    PAF_SAMPLES = 10           # points sampled along a candidate connection
+    PAF_SCORE_THRESHOLD = 0.05 # PAF alignment a sample needs to count
+    PAF_MIN_RATIO = 0.8        # fraction of samples that must count
+    MIN_PERSON_KEYPOINTS = 3   # people with fewer keypoints are dropped
+
+    def __init__(self, model_path, model_pose=None, config_path=None, batch_size=8,
+                 net_height=368, threshold=0.1):
+        import cv2   # only needed for in-process detection
+        self.cv2 = cv2
+
+        self.net = cv2.dnn.readNet(model_path, config_path or "")
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.batch_size = batch_size
+        self.net_height = net_height
+        self.threshold = threshold
+
+        # Check the output channels once, so a model mismatch fails here and not inside detect()
+        self.net.setInput(np.zeros((1, 3, net_height, net_height), np.float32))
+        channels = self.net.forward().shape[1]
+        matches = [m for m in PAF_LAYOUTS if output_channels(m) == channels]
+        if not matches:
+            expected = ", ".join(f"{m}: {output_channels(m)}" for m in PAF_LAYOUTS)
+            raise ValueError(f"{model_path} outputs {channels} channels, expected one of {expected}")
+        if model_pose is not None and model_pose != matches[0]:
+            raise ValueError(f"{model_path} is a {matches[0]} network ({channels} output channels), "
+                             f"not {model_pose}")
+        super().__init__(matches[0])
+        self.pairs = PAF_LAYOUTS[self.model_pose]["pairs"]
+        self.paf_channels = [(self.num_keypoints + 1 + cx, self.num_keypoints + 1 + cy)
+                             for cx, cy in PAF_LAYOUTS[self.model_pose]["map_index"]]
+
+    def input_size(self, width, height):
+        # Network input (width, height): net_height high, width keeping the frame aspect, a multiple of 16
+        return max(16, int(round(self.net_height * width / height / 16)) * 16), self.net_height
+
+    def detect(self, images):
+        cv2 = self.cv2
+        height, width = images[0].shape[:2]   # frames of one recording share a size
+        in_width, in_height = self.input_size(width, height)
+
+        # RGB frames, so swapRB gives the BGR order the OpenPose models were trained on
+        blob = cv2.dnn.blobFromImages(images, 1.0 / 255, (in_width, in_height), (0, 0, 0), swapRB=True, crop=False)
+        self.net.setInput(blob)
+        output = self.net.forward()   # (N, channels, H_out, W_out): heatmaps, background, PAFs
+
+        results = []
+        for maps in output:
+            # Upsample heatmaps and PAFs from the 8x smaller output to the input size before finding peaks
+            maps = cv2.resize(maps.transpose(1, 2, 0), (in_width, in_height), interpolation=cv2.INTER_CUBIC)
+            maps = np.ascontiguousarray(maps.transpose(2, 0, 1))
+            people = self.group_people(maps)
+            if len(people):
+                # Input pixel centres to frame pixels
+                found = people[:, :, 2] > 0
+                people[:, :, 0] = np.where(found, (people[:, :, 0] + 0.5) * width / in_width, 0)
+                people[:, :, 1] = np.where(found, (people[:, :, 1] + 0.5) * height / in_height, 0)
+            results.append(people)
+        return results
+
+    def find_peaks(self, heatmap):
+        # Local maxima above the threshold as (x, y, score) rows in heatmap pixels. Upsampling leaves a
+        # cell's peak tied between neighbouring pixels, so touching maxima are one peak at their centroid
+        cv2 = self.cv2
+        local_max = (heatmap == cv2.dilate(heatmap, np.ones((3, 3), np.uint8))) & (heatmap > self.threshold)
+        count, labels, _, centroids = cv2.connectedComponentsWithStats(local_max.astype(np.uint8), connectivity=8)
+        ys, xs = np.nonzero(local_max)
+        scores = np.zeros(count)
+        np.maximum.at(scores, labels[ys, xs], heatmap[ys, xs])
+        return np.column_stack((centroids[1:], scores[1:])).astype(np.float64)
+
+    def score_connections(self, maps, cand_a, cand_b, paf_channels):
+        # Greedy one-to-one matching of candidates by PAF line integral, returns (index a, index b) pairs
+        if len(cand_a) == 0 or len(cand_b) == 0:
+            return []
+        map_h, map_w = maps.shape[1:]
+        delta = cand_b[None, :, :2] - cand_a[:, None, :2]                  # (na, nb, 2)
+        norm = np.linalg.norm(delta, axis=2)
+        unit = delta / np.maximum(norm, 1e-6)[:, :, None]
+
+        steps = np.linspace(0, 1, self.PAF_SAMPLES)
+        samples = cand_a[:, None, None, :2] + steps[None, None, :, None] * delta[:, :, None, :]
+        xs = np.clip(np.rint(samples[..., 0]).astype(int), 0, map_w - 1)
+        ys = np.clip(np.rint(samples[..., 1]).astype(int), 0, map_h - 1)
+        alignment = (maps[paf_channels[0]][ys, xs] * unit[:, :, None, 0] +
+                     maps[paf_channels[1]][ys, xs] * unit[:, :, None, 1])  # (na, nb, samples)
+
+        # Mean alignment, penalising connections longer than half the map height
+        score = alignment.mean(axis=2) + np.minimum(0.5 * map_h / np.maximum(norm, 1e-6) - 1, 0)
+        valid = ((alignment > self.PAF_SCORE_THRESHOLD).mean(axis=2) >= self.PAF_MIN_RATIO) & (score > 0) & (norm > 0)
+
+        connections = []
+        used_a, used_b = set(), set()
+        for a, b in sorted(zip(*np.nonzero(valid)), key=lambda ab: -score[ab]):
+            if a not in used_a and b not in used_b:
+                connections.append((a, b))
+                used_a.add(a)
+                used_b.add(b)
+        return connections
+
+    def group_people(self, maps):
+        # (num_people, num_keypoints, 3) in heatmap pixels, built by following the PAF connections
+        peaks = [self.find_peaks(maps[k]) for k in range(self.num_keypoints)]
+
+        assigned = []   # per person: peak index of each keypoint, -1 if missing
+        for (part_a, part_b), paf_channels in zip(self.pairs, self.paf_channels):
+            for a, b in self.score_connections(maps, peaks[part_a], peaks[part_b], paf_channels):
+                for person in assigned:
+                    if person[part_a] == a:
+                        if person[part_b] < 0:
+                            person[part_b] = b
+                        break
+                    if person[part_b] == b:
+                        if person[part_a] < 0:
+                            person[part_a] = a
+                        break
+                else:
+                    person = np.full(self.num_keypoints, -1)
+                    person[part_a], person[part_b] = a, b
+                    assigned.append(person)
+
+        people = [np.array([peaks[k][i] if i >= 0 else (0, 0, 0) for k, i in enumerate(person)])
+                  for person in assigned if (person >= 0).sum() >= self.MIN_PERSON_KEYPOINTS]
+        return np.stack(people) if people else self.no_people()
+
+
+class StubBackend(PoseBackend):
+    # Deterministic keypoints for tests: one person per frame, a fixed layout jittered by the frame number
+
+    def __init__(self, model_pose, batch_size=8, seed=0):
+        super().__init__(model_pose)
+        self.batch_size = batch_size
+        self.seed = seed
+        self.frame_idx = 0
+
+    def detect(self, images):
+        results = []
+        for image in images:
+            height, width = image.shape[:2]
+            rng = np.random.default_rng(self.seed + self.frame_idx)
+            # Keypoints on a grid in the centre half of the frame
+            grid = np.arange(self.num_keypoints)
+            cols = int(np.ceil(np.sqrt(self.num_keypoints)))
+            x = width * (0.25 + 0.5 * (grid % cols) / cols) + rng.uniform(-2, 2, self.num_keypoints)
+            y = height * (0.25 + 0.5 * (grid // cols) / cols) + rng.uniform(-2, 2, self.num_keypoints)
+            confidence = np.full(self.num_keypoints, 0.9)
+            results.append(np.stack((x, y, confidence), axis=1)[None])
+            self.frame_idx += 1
+        return results
+
+    def skip(self):
+        self.frame_idx += 1
+
+
+def create_backend(source, model_pose=None):
+    '''
+    Backend from a command line pose source:
+    - an OpenPose JSON directory
+    - "stub" for the deterministic test backend
+    - a keypoints_2d.npz saved by 3dconvert.py
+    - an .onnx model, or "pose_deploy.prototxt,pose_iter.caffemodel" for a Caffe model
+    Model and .npz files decide the model themselves; otherwise model_pose defaults to BODY_135.
+    '''
+    if os.path.isdir(source):
+        return OpenPoseJsonBackend(source, model_pose or "BODY_135")
+    if source.endswith(".npz"):
+        return ArrayBackend(source, model_pose)
+    if source == "stub":
+        return StubBackend(model_pose or "BODY_135")
+    if "," in source:
+        config_path, model_path = source.split(",", 1)
+        return OpenCVBackend(model_path, model_pose, config_path=config_path)
+    if source.endswith(".onnx"):
+        return OpenCVBackend(source, model_pose)
+    raise ValueError(f"Unknown pose source {source}, expected a JSON directory, 'stub', a .npz or a model file")
@@ -0,0 +1,310 @@
+'''
+Recording access without reopening the .bag file
+- Saves and loads the camera metadata sidecar (camera_metadata.json) written by extract.py.
+- Writes and reads the depth cache: depth aligned to color and spatial filtered, as compressed NPZ chunks.
+- Deprojects pixels to 3D from the sidecar intrinsics, matching rs2_deproject_pixel_to_point.
+- Iterates (color, depth) frames from either a .bag file or an extract.py output folder.
+  A folder takes calibration from the sidecar and depth from the cache; color, when needed,
+  comes from the recorded .bag (color stream only, lossless) or else from color_output.avi.
+pyrealsense2 is only imported when a .bag file is opened, cv2 only when color is read from color_output.avi.
+'''
+
+import json
+import os
+
+import numpy as np
+
+
+METADATA_FILE = "camera_metadata.json"
+DEPTH_CACHE_DIR = "depth"
+COLOR_VIDEO = "color_output.avi"
+DEPTH_FRAMES_PER_CHUNK = 60   # ~37 MB of 640x480 depth in memory before compression
+
+
+class Intrinsics:
+    # Plain copy of rs.intrinsics: width, height, fx, fy, ppx, ppy, model (distortion name) and coeffs
+
+    def __init__(self, values):
+        self.width = int(values["width"])
+        self.height = int(values["height"])
+        self.fx = float(values["fx"])
+        self.fy = float(values["fy"])
+        self.ppx = float(values["ppx"])
+        self.ppy = float(values["ppy"])
+        self.model = values["model"]
+        self.coeffs = [float(c) for c in values["coeffs"]]
+
+    def to_dict(self):
+        return {"width": self.width, "height": self.height, "fx": self.fx, "fy": self.fy,
+                "ppx": self.ppx, "ppy": self.ppy, "model": self.model, "coeffs": self.coeffs}
+
+
+def intrinsics_from_rs(rs_intrinsics):
+    # rs.intrinsics to Intrinsics, the distortion model stored by name (e.g. "inverse_brown_conrady")
+    return Intrinsics({
+        "width": rs_intrinsics.width, "height": rs_intrinsics.height,
+        "fx": rs_intrinsics.fx, "fy": rs_intrinsics.fy,
+        "ppx": rs_intrinsics.ppx, "ppy": rs_intrinsics.ppy,
+        "model": str(rs_intrinsics.model).split(".")[-1],
+        "coeffs": list(rs_intrinsics.coeffs),
+    })
+
+
+def deproject_pixels(u, v, z, intrinsics):
+    # Vectorized rs2_deproject_pixel_to_point (librealsense rsutil.h) for arrays of pixels (u, v) with depth z in meters
+    x = (np.asarray(u, dtype=np.float64) - intrinsics.ppx) / intrinsics.fx
+    y = (np.asarray(v, dtype=np.float64) - intrinsics.ppy) / intrinsics.fy
+    k1, k2, p1, p2, k3 = intrinsics.coeffs[:5]
+    if intrinsics.model in ("inverse_brown_conrady", "brown_conrady"):
+        # Iterative undistortion, same 10 steps as librealsense; inverse_brown_conrady
+        # evaluates the tangential terms at the radially distorted point
+        xo, yo = x, y
+        for _ in range(10):
+            r2 = x * x + y * y
+            icdist = 1 / (1 + ((k3 * r2 + k2) * r2 + k1) * r2)
+            xq, yq = (x / icdist, y / icdist) if intrinsics.model == "inverse_brown_conrady" else (x, y)
+            delta_x = 2 * p1 * xq * yq + p2 * (r2 + 2 * xq * xq)
+            delta_y = 2 * p2 * xq * yq + p1 * (r2 + 2 * yq * yq)
+            x = (xo - delta_x) * icdist
+            y = (yo - delta_y) * icdist
+    elif intrinsics.model != "none":
+        raise ValueError(f"Unsupported distortion model {intrinsics.model}")
+    z = np.asarray(z, dtype=np.float64)
+    return np.stack((x * z, y * z, z), axis=-1)
+
+
+def pixel_rays(intrinsics):
+    # (3, height, width) float32 x, y, z planes of the point at depth 1 m for every pixel; undistortion
+    # depends only on the pixel, so deprojecting pixel (u, v) is rays[:, v, u] * z
+    v, u = np.mgrid[0:intrinsics.height, 0:intrinsics.width]
+    rays = deproject_pixels(u, v, np.ones(u.shape), intrinsics)
+    return np.ascontiguousarray(rays.transpose(2, 0, 1), dtype=np.float32)
+
+
+def save_metadata(output_dir, metadata):
+    path = os.path.join(output_dir, METADATA_FILE)
+    with open(path, "w") as f:
+        json.dump(metadata, f, indent=2)
+    return path
+
+
+def load_metadata(recording_dir):
+    # Sidecar dict, with color/depth intrinsics as Intrinsics objects
+    with open(os.path.join(recording_dir, METADATA_FILE), "r") as f:
+        metadata = json.load(f)
+    for stream in ("color", "depth"):
+        metadata[stream]["intrinsics"] = Intrinsics(metadata[stream]["intrinsics"])
+    return metadata
+
+
+class DepthCacheWriter:
+    # Collects depth images (uint16, raw units) and writes them as depth_XXXXX.npz chunks
+
+    def __init__(self, recording_dir):
+        self.cache_dir = os.path.join(recording_dir, DEPTH_CACHE_DIR)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.depth_images, self.timestamps = [], []
+        self.chunk_idx = 0
+        self.num_frames = 0
+
+    def add(self, depth_image, timestamp):
+        self.depth_images.append(np.array(depth_image, dtype=np.uint16))
+        self.timestamps.append(timestamp)
+        self.num_frames += 1
+        if len(self.depth_images) >= DEPTH_FRAMES_PER_CHUNK:
+            self.flush()
+
+    def flush(self):
+        if not self.depth_images:
+            return
+        np.savez_compressed(
+            os.path.join(self.cache_dir, f"depth_{self.chunk_idx:05d}.npz"),
+            depth=np.stack(self.depth_images),
+            timestamp=np.array(self.timestamps, dtype=np.float64),
+        )
+        self.depth_images, self.timestamps = [], []
+        self.chunk_idx += 1
+
+    close = flush
+
+
+def iter_cached_depth(recording_dir):
+    # (depth image, color timestamp) pairs from the cache, in frame order
+    cache_dir = os.path.join(recording_dir, DEPTH_CACHE_DIR)
+    for chunk_file in sorted(f for f in os.listdir(cache_dir) if f.endswith(".npz")):
+        with np.load(os.path.join(cache_dir, chunk_file)) as chunk:
+            depth, timestamps = chunk["depth"], chunk["timestamp"]
+        for depth_image, timestamp in zip(depth, timestamps):
+            yield depth_image, float(timestamp)
+
+
+class Recording:
+    '''
+    Color/depth frames plus calibration from a .bag file or an extract.py output folder.
+    - intrinsics: color Intrinsics (depth is aligned to color in both cases)
+    - depth_scale: meters per depth unit
+    frames(need_color) yields (color RGB image or None, depth image) per frame, and (None, None)
+    for frames missing a stream. Folders read calibration from the sidecar and depth from the cache;
+    color is decoded from the recorded .bag (color stream only) when it is still there and
+    pyrealsense2 is installed, else read from color_output.avi.
+    '''
+
+    def __init__(self, source):
+        self.source = source
+        self.pipeline = None
+        if os.path.isdir(source):
+            self.metadata = load_metadata(source)
+            self.intrinsics = self.metadata["color"]["intrinsics"]
+            self.depth_scale = self.metadata["depth_scale"]
+        else:
+            self._open_bag(source)
+
+    def _open_bag(self, bag_file):
+        import pyrealsense2 as rs   # only needed for .bag input
+        self.rs = rs
+
+        # RealSense setup
+        self.pipeline = rs.pipeline()
+        config = rs.config()
+        config.enable_device_from_file(bag_file, repeat_playback=False)
+        profile = self.pipeline.start(config)
+
+        # Extract camera intrinsics and depth scale (convert depth units to meters)
+        color_stream = profile.get_stream(rs.stream.color)
+        self.intrinsics = intrinsics_from_rs(color_stream.as_video_stream_profile().get_intrinsics())
+        self.depth_scale = profile.get_device().first_depth_sensor().get_depth_scale()
+
+        # Align depth to color frame
+        self.align = rs.align(rs.stream.color)
+
+        # Define filters
+        '''
+        Spatial reduces noise in the depth image by smoothing neighboring pixels, especially around edges.
+        Temporal reduces flickering or inconsistent depth values over time (across frames)
+        Hole filling fill missing holes with estimated values from surrounding pixels, making the depth image more complete.
+        for more: https://dev.intelrealsense.com/docs/post-processing-filters
+        '''
+        self.spatial = rs.spatial_filter()
+        #self.temporal = rs.temporal_filter()
+        #self.hole_filling = rs.hole_filling_filter()
+
+        # Playback control for bag file
+        self.playback = profile.get_device().as_playback()
+        self.playback.set_real_time(False)
+
+    def frames(self, need_color=True):
+        if not os.path.isdir(self.source):
+            return self._bag_frames(need_color)
+        if need_color and self._open_color_bag():
+            return self._cached_frames_bag_color()
+        if need_color and not os.path.isfile(os.path.join(self.source, COLOR_VIDEO)):
+            raise FileNotFoundError(
+                f"No color frames for {self.source}: the recorded bag {self.metadata.get('bag_file')} "
+                f"cannot be opened (missing file or pyrealsense2) and there is no {COLOR_VIDEO}")
+        return self._cached_frames(need_color)
+
+    def _cached_frames(self, need_color):
+        capture = None
+        if need_color:
+            import cv2   # only needed to decode color_output.avi
+            capture = cv2.VideoCapture(os.path.join(self.source, COLOR_VIDEO))
+        try:
+            for depth_image, _ in iter_cached_depth(self.source):
+                color_image = None
+                if capture is not None:
+                    ok, bgr_image = capture.read()
+                    if not ok:
+                        print("Color video ended before the depth cache.")
+                        return
+                    color_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2RGB)
+                yield color_image, depth_image
+        finally:
+            if capture is not None:
+                capture.release()
+
+    def _open_color_bag(self):
+        # Color-only playback of the bag recorded in the sidecar, False if it cannot be opened
+        bag_file = self.metadata.get("bag_file")
+        if not bag_file or not os.path.isfile(bag_file):
+            return False
+        try:
+            import pyrealsense2 as rs
+        except ImportError:
+            return False
+        self.rs = rs
+        self.pipeline = rs.pipeline()
+        config = rs.config()
+        config.enable_device_from_file(bag_file, repeat_playback=False)
+        config.enable_stream(rs.stream.color)
+        profile = self.pipeline.start(config)
+        self.playback = profile.get_device().as_playback()
+        self.playback.set_real_time(False)
+        return True
+
+    def _next_bag_color(self):
+        # (timestamp, RGB image) of the next color frame, None at the end of the bag
+        rs = self.rs
+        if self.playback.current_status == rs.playback_status.stopped:
+            return None
+        try:
+            frames = self.pipeline.wait_for_frames()
+        except RuntimeError:
+            return None
+        color_frame = frames.get_color_frame() if frames else None
+        if not color_frame:
+            return None
+        return color_frame.get_timestamp(), np.array(color_frame.get_data())
+
+    def _cached_frames_bag_color(self):
+        # Cached depth paired with the bag color frame of the same timestamp (extract.py keyed the
+        # cache by color timestamp); cache frames whose color is not found are skipped
+        color = self._next_bag_color()
+        for depth_image, timestamp in iter_cached_depth(self.source):
+            while color is not None and color[0] < timestamp:
+                color = self._next_bag_color()
+            if color is None or color[0] != timestamp:
+                print("Skipping frame, no color frame in the bag for the cached depth.")
+                yield None, None
+                continue
+            yield color[1], depth_image
+
+    def _bag_frames(self, need_color):
+        rs = self.rs
+        while True:
+            try:
+                frames = self.pipeline.wait_for_frames()
+            except RuntimeError as e:
+                print(f"Playback ended or error occurred: {e}")
+                return
+            if not frames:
+                print("No more frames from bag.")
+                return
+
+            # Align depth frame to color frame
+            aligned_frames = self.align.process(frames)
+            depth_frame = aligned_frames.get_depth_frame()
+            color_frame = aligned_frames.get_color_frame()
+
+            # Skip frames missing either stream
+            if not depth_frame or not color_frame:
+                print("Skipping frame, missing depth or color frame.")
+                yield None, None
+                continue
+
+            # Apply filters to depth frame
+            depth_frame = self.spatial.process(depth_frame)
+            #depth_frame = self.temporal.process(depth_frame)
+            #depth_frame = self.hole_filling.process(depth_frame)
+
+            # Copied because librealsense reuses frame buffers while a batch is collected
+            depth_image = np.array(depth_frame.get_data())
+            color_image = np.array(color_frame.get_data()) if need_color else None
+            yield color_image, depth_image
+
+            if self.playback.current_status == rs.playback_status.stopped:
+                print("Playback ended.")
+                return
+
+    def close(self):
+        if self.pipeline is not None:
+            self.pipeline.stop()
@@ -0,0 +1,216 @@
+'''
+Shared skeleton registry for the OpenPose models used in this project
+- Defines named keypoint groups and connection pairs for BODY_25, BODY_25B, BODY_135, COCO and MPI.
+- Defines named connection sets (extra pairs measured between keypoints of other groups).
+- Declares which keypoint groups and connection sets each pipeline stage needs.
+- Compiles a model + group selection into a sorted index array and its connections,
+  so every stage loads, samples, stores and plots only the keypoints it uses.
+'''
+
+import numpy as np
+
+
+# BODY_135 keypoint offsets
+H135 = 25   # Starting index of left hand keypoints
+R135 = 45   # Starting index of right hand keypoints
+F135 = 65   # Face keypoints start index
+
+
+def _hand_connections(wrist, start):
+    # Wrist to each finger base, then along the 4 keypoints of every finger
+    pairs = []
+    for finger in range(5):
+        base = start + 4 * finger
+        pairs += [(wrist, base), (base, base + 1), (base + 1, base + 2), (base + 2, base + 3)]
+    return pairs
+
+
+def _hand_spans(wrist, start):
+    # Wrist to the tip of each finger
+    return [(wrist, start + 4 * finger + 3) for finger in range(5)]
+
+
+# Body connections (same as OpenPose render pairs)
+BODY_25_CONNECTIONS = [
+    (1, 8), (1, 2), (1, 5), (2, 3), (3, 4), (5, 6), (6, 7),
+    (8, 9), (9, 10), (10, 11), (8, 12), (12, 13), (13, 14),
+    (1, 0), (0, 15), (15, 17), (0, 16), (16, 18),
+    (14, 19), (19, 20), (14, 21), (11, 22), (22, 23), (11, 24)
+]
+
+BODY_25B_CONNECTIONS = [
+    (0, 1), (0, 2), (1, 3), (2, 4),
+    (0, 5), (0, 6), (5, 7), (6, 8), (7, 9), (8, 10),
+    (5, 11), (6, 12), (11, 13), (12, 14), (13, 15), (14, 16),
+    (15, 19), (19, 20), (15, 21), (16, 22), (22, 23), (16, 24),
+    (5, 17), (6, 17), (17, 18), (11, 12)
+]
+
+COCO_CONNECTIONS = [
+    (1, 2), (1, 5), (2, 3), (3, 4), (5, 6), (6, 7),
+    (1, 8), (8, 9), (9, 10), (1, 11), (11, 12), (12, 13),
+    (1, 0), (0, 14), (14, 16), (0, 15), (15, 17)
+]
+
+MPI_CONNECTIONS = [
+    (0, 1), (1, 2), (2, 3), (3, 4), (1, 5), (5, 6), (6, 7),
+    (1, 14), (14, 8), (8, 9), (9, 10), (14, 11), (11, 12), (12, 13)
+]
+
+# Arm and shoulder limbs measured by limbgraph.py: shoulder to elbow, hip and neck, elbow to wrist
+BODY_25B_UPPER_LIMBS = [(5, 7), (5, 11), (5, 17), (6, 8), (6, 12), (6, 17), (7, 9), (8, 10)]
+BODY_25_UPPER_LIMBS = [(5, 6), (5, 12), (5, 1), (2, 3), (2, 9), (2, 1), (6, 7), (3, 4)]
+COCO_UPPER_LIMBS = [(5, 6), (5, 11), (5, 1), (2, 3), (2, 8), (2, 1), (6, 7), (3, 4)]
+
+# Model registry: number of keypoints, named groups, connections per group and
+# connection sets. A hand group's connections start at the body wrist, so selecting
+# a hand also pulls in its wrist keypoint. A connection set has no keypoints of its
+# own, selecting it keeps the keypoints its pairs join.
+SKELETONS = {
+    "BODY_25": {
+        "num_keypoints": 25,
+        "groups": {"body": range(0, 25)},
+        "connections": {"body": BODY_25_CONNECTIONS},
+        "connection_sets": {"upper_limbs": BODY_25_UPPER_LIMBS},
+    },
+    "BODY_25B": {
+        "num_keypoints": 25,
+        "groups": {"body": range(0, 25)},
+        "connections": {"body": BODY_25B_CONNECTIONS},
+        "connection_sets": {"upper_limbs": BODY_25B_UPPER_LIMBS},
+    },
+    "BODY_135": {
+        "num_keypoints": 135,
+        "groups": {
+            "body": range(0, H135),
+            "left_hand": range(H135, R135),
+            "right_hand": range(R135, F135),
+            "face": range(F135, 135),
+        },
+        "connections": {
+            "body": BODY_25B_CONNECTIONS,
+            "left_hand": _hand_connections(9, H135),
+            "right_hand": _hand_connections(10, R135),
+            "face": [(F135 + i, F135 + i + 1) for i in range(16)],  # face contour
+        },
+        "connection_sets": {
+            "upper_limbs": BODY_25B_UPPER_LIMBS,
+            "hand_spans": _hand_spans(10, R135) + _hand_spans(9, H135),   # wrist to finger tips
+        },
+    },
+    "COCO": {
+        "num_keypoints": 18,
+        "groups": {"body": range(0, 18)},
+        "connections": {"body": COCO_CONNECTIONS},
+        "connection_sets": {"upper_limbs": COCO_UPPER_LIMBS},
+    },
+    "MPI": {
+        "num_keypoints": 15,
+        "groups": {"body": range(0, 15)},
+        "connections": {"body": MPI_CONNECTIONS},
+        "connection_sets": {"upper_limbs": COCO_UPPER_LIMBS},   # same arm and hip indices as COCO
+    },
+}
+
+# Keypoint groups and connection sets each stage works with
+STAGE_GROUPS = {
+    "plotvideo": ("body", "left_hand", "right_hand"),
+    "limbgraph": ("upper_limbs", "hand_spans", "left_hand", "right_hand"),
+    "pointcloud": ("body", "left_hand", "right_hand"),
+}
+
+
+def pipeline_groups(stages=None):
+    # Union of the groups needed by the given stages (all stages by default), in first-seen order
+    if stages is None:
+        stages = STAGE_GROUPS.keys()
+    groups = []
+    for stage in stages:
+        for group in STAGE_GROUPS[stage]:
+            if group not in groups:
+                groups.append(group)
+    return tuple(groups)
+
+
+def _names(skeleton):
+    # Keypoint group and connection set names of one model
+    return set(skeleton["groups"]) | set(skeleton["connection_sets"])
+
+
+def select_groups(model, groups):
+    # Keep only groups/connection sets the model defines (e.g. hands exist only in BODY_135), names no model defines are an error
+    known = set().union(*(_names(other) for other in SKELETONS.values()))
+    unknown = [g for g in groups if g not in known]
+    if unknown:
+        raise ValueError(f"Unknown keypoint groups {unknown}, expected some of {sorted(known)}")
+    selected = tuple(g for g in groups if g in _names(SKELETONS[model]))
+    if not selected:
+        raise ValueError(f"None of the groups {list(groups)} exist for model {model}")
+    return selected
+
+
+def compile_selection(model, groups):
+    '''
+    Compile a model and keypoint groups / connection sets into index arrays.
+    Returns (keypoint_ids, connections):
+    - keypoint_ids: sorted int array of original OpenPose keypoint indices to keep
+    - connections: (N, 2) int array of connection pairs in original keypoint indices
+    '''
+    if model not in SKELETONS:
+        raise ValueError(f"Unknown model {model}, expected one of {list(SKELETONS)}")
+    skeleton = SKELETONS[model]
+    groups = select_groups(model, groups)
+
+    ids = set()
+    pairs = []
+    for group in groups:
+        ids.update(skeleton["groups"].get(group, ()))
+        group_pairs = skeleton["connections"][group] if group in skeleton["groups"] else skeleton["connection_sets"][group]
+        for i, j in group_pairs:
+            ids.update((i, j))
+            pairs.append((i, j))
+
+    keypoint_ids = np.array(sorted(ids), dtype=np.intp)
+    connections = np.array(pairs, dtype=np.intp).reshape(-1, 2)
+    return keypoint_ids, connections
+
+
+def position_lookup(keypoint_ids):
+    # Array mapping an original keypoint index to its position in the stored subset (-1 if not stored)
+    keypoint_ids = np.asarray(keypoint_ids, dtype=np.intp)
+    lookup = np.full(int(keypoint_ids.max()) + 1 if len(keypoint_ids) else 0, -1, dtype=np.intp)
+    lookup[keypoint_ids] = np.arange(len(keypoint_ids))
+    return lookup
+
+
+def stored_keypoint_ids(frames, num_keypoints):
+    # Keypoint ids stored by 3dconvert.py, written once on the first frame of the 3D keypoints JSON
+    # (files written before keypoint_ids was stored hold all num_keypoints per person)
+    return (frames[0].get("keypoint_ids") if frames else None) or list(range(num_keypoints))
+
+
+def sample_frame(frame_obj, keypoint_ids, stored_ids):
+    '''
+    Sample the selected keypoints from one frame of the 3D keypoints JSON.
+    stored_ids are the keypoint ids the file stores per person (see stored_keypoint_ids).
+    Returns points ordered as keypoint_ids for every person in the frame
+    (person p starts at p * len(keypoint_ids)); keypoints not stored are [None, None, None].
+    '''
+    points = frame_obj["keypoints_3d"]
+    stored_ids = frame_obj.get("keypoint_ids") or stored_ids
+    lookup = position_lookup(stored_ids)
+    positions = np.full(len(keypoint_ids), -1, dtype=np.intp)
+    in_range = keypoint_ids < len(lookup)
+    positions[in_range] = lookup[keypoint_ids[in_range]]
+
+    stored = len(stored_ids)
+    num_people = max(len(points) // stored, 1) if points else 0
+    sampled = []
+    for person in range(num_people):
+        for pos in positions:
+            index = person * stored + pos
+            if pos < 0 or index >= len(points) or points[index] is None:
+                sampled.append([None, None, None])
+            else:
+                sampled.append(points[index])
+    return sampled
@@ -0,0 +1,245 @@
+'''
+Pipeline tests on a synthetic recording
+- Checks the skeleton registry, 3D keypoint sampling (including legacy 135-keypoint files),
+  deprojection against librealsense and the PAF grouping of the OpenCV backend.
+- Runs 3dconvert.py, pointcloud.py, plotvideo.py and limbgraph.py end to end with the stub backend
+  on a synthetic camera metadata sidecar, depth cache and color video.
+Run with: python -m pytest tests
+'''
+
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import pose_backends
+import recording
+import skeletons
+
+WIDTH, HEIGHT = 64, 48
+NUM_FRAMES = 40      # limbgraph.py only measures frames 30 to 170
+PLANE_DEPTH = 1500   # depth units (mm) of the synthetic wall
+
+
+def run_script(*args):
+    # Run a pipeline script from the repository folder, as main.py does
+    env = dict(os.environ, MPLBACKEND="Agg")
+    return subprocess.run([sys.executable, *args], cwd=REPO_DIR, env=env, capture_output=True, text=True)
+
+
+@pytest.fixture(scope="module")
+def recording_dir(tmp_path_factory):
+    # extract.py style output folder: camera_metadata.json, depth cache and color_output.avi
+    cv2 = pytest.importorskip("cv2")
+    out = str(tmp_path_factory.mktemp("recording"))
+    intrinsics = {"width": WIDTH, "height": HEIGHT, "fx": 60.0, "fy": 60.0, "ppx": 32.0, "ppy": 24.0,
+                  "model": "inverse_brown_conrady", "coeffs": [0.1, -0.05, 0.002, -0.003, 0.01]}
+    stream = {"width": WIDTH, "height": HEIGHT, "fps": 30, "format": "rgb8", "intrinsics": intrinsics}
+    recording.save_metadata(out, {
+        "device_serial": None,
+        "depth_scale": 0.001,
+        "color": stream,
+        "depth": dict(stream, format="z16"),
+        "depth_to_color": {"rotation": [1, 0, 0, 0, 1, 0, 0, 0, 1], "translation": [0, 0, 0]},
+        "depth_cache": {"directory": recording.DEPTH_CACHE_DIR, "aligned_to": "color",
+                        "filters": ["spatial"], "frames": NUM_FRAMES},
+    })
+
+    depth_cache = recording.DepthCacheWriter(out)
+    video = cv2.VideoWriter(os.path.join(out, recording.COLOR_VIDEO), cv2.VideoWriter_fourcc(*"MJPG"), 30, (WIDTH, HEIGHT))
+    for frame in range(NUM_FRAMES):
+        depth_cache.add(np.full((HEIGHT, WIDTH), PLANE_DEPTH, np.uint16), frame * 33.3)
+        video.write(np.full((HEIGHT, WIDTH, 3), frame * 5, np.uint8))
+    depth_cache.close()
+    video.release()
+    return out
+
+
+def test_compile_selection_groups_and_connection_sets():
+    keypoint_ids, connections = skeletons.compile_selection("BODY_135", skeletons.STAGE_GROUPS["limbgraph"])
+    pairs = set(map(tuple, connections.tolist()))
+    assert len(connections) == len(pairs) == 58
+    assert {(5, 7), (8, 10), (9, 28), (10, 64)} <= pairs
+    assert (0, 1) not in pairs   # head connections are not limbgraph limbs
+    assert set(keypoint_ids.tolist()) == {i for pair in pairs for i in pair}
+
+    # Hands only exist in BODY_135, names no model defines are an error
+    assert skeletons.select_groups("BODY_25", ("body", "left_hand")) == ("body",)
+    with pytest.raises(ValueError):
+        skeletons.select_groups("BODY_135", ("body", "lefthand"))
+
+
+def test_sample_frame_legacy_and_stored_ids():
+    keypoint_ids, _ = skeletons.compile_selection("BODY_135", ("body",))
+    person = [[k, 0.0, 1.0] for k in range(135)]
+
+    # Legacy file: all 135 keypoints per person, no keypoint_ids
+    legacy = [{"frame": 0, "keypoints_3d": person + person}]
+    stored = skeletons.stored_keypoint_ids(legacy, 135)
+    sampled = skeletons.sample_frame(legacy[0], keypoint_ids, stored)
+    assert [p[0] for p in sampled] == keypoint_ids.tolist() * 2
+
+    # Current file: ids stored once on the first frame, missing ids come back as None
+    kept = [0, 5, 9]
+    frames = [{"frame": 0, "model": "BODY_135", "keypoint_ids": kept, "keypoints_3d": [person[k] for k in kept]},
+              {"frame": 1, "keypoints_3d": [person[k] for k in kept]}]
+    stored = skeletons.stored_keypoint_ids(frames, 135)
+    sampled = skeletons.sample_frame(frames[1], np.array([5, 6, 9]), stored)
+    assert sampled == [person[5], [None, None, None], person[9]]
+
+
+@pytest.mark.parametrize("model, expected", [
+    # rs2_deproject_pixel_to_point from pyrealsense2 2.59
+    ("inverse_brown_conrady", [[-0.7489042, -0.5293205, 1.5], [0.9116724, 0.6754484, 2.0]]),
+    ("brown_conrady", [[-0.7489727, -0.5293693, 1.5], [0.9116068, 0.6754002, 2.0]]),
+])
+def test_deproject_pixels_matches_librealsense(model, expected):
+    intrinsics = recording.Intrinsics({"width": 640, "height": 480, "fx": 600, "fy": 605, "ppx": 320, "ppy": 240,
+                                       "model": model, "coeffs": [0.1, -0.05, 0.002, -0.003, 0.01]})
+    points = recording.deproject_pixels([10, 600], [20, 450], [1.5, 2.0], intrinsics)
+    np.testing.assert_allclose(points, expected, atol=1e-6)
+
+    rays = recording.pixel_rays(intrinsics)
+    np.testing.assert_allclose(rays[:, [20, 450], [10, 600]].T * [[1.5], [2.0]], expected, atol=1e-6)
+
+
+class FakeNet:
+    # Stands in for cv2.dnn: returns fixed MPI heatmaps and PAFs whatever the input
+    def __init__(self, maps):
+        self.maps = maps
+        self.batch = 1
+
+    def setPreferableBackend(self, backend):
+        pass
+
+    def setPreferableTarget(self, target):
+        pass
+
+    def setInput(self, blob):
+        self.batch = len(blob)
+
+    def forward(self):
+        return np.repeat(self.maps[None], self.batch, axis=0)
+
+
+def mpi_maps(people, out_width, out_height):
+    # Gaussian heatmaps and unit-vector PAF bands for people given as (15, 2) cell positions
+    num_keypoints = skeletons.SKELETONS["MPI"]["num_keypoints"]
+    layout = pose_backends.PAF_LAYOUTS["MPI"]
+    maps = np.zeros((pose_backends.output_channels("MPI"), out_height, out_width), np.float32)
+    ys, xs = np.mgrid[0:out_height, 0:out_width]
+    for cells in people:
+        for k, (x, y) in enumerate(cells):
+            maps[k] = np.maximum(maps[k], np.exp(-((xs - x) ** 2 + (ys - y) ** 2) / 2.0))
+        for (a, b), (cx, cy) in zip(layout["pairs"], layout["map_index"]):
+            delta = cells[b] - cells[a]
+            unit = delta / np.linalg.norm(delta)
+            # Cells within 1 cell of the segment
+            t = np.clip(((xs - cells[a][0]) * delta[0] + (ys - cells[a][1]) * delta[1]) / delta.dot(delta), 0, 1)
+            band = np.hypot(xs - cells[a][0] - t * delta[0], ys - cells[a][1] - t * delta[1]) <= 1
+            maps[num_keypoints + 1 + cx][band] = unit[0]
+            maps[num_keypoints + 1 + cy][band] = unit[1]
+    return maps
+
+
+def test_opencv_backend_groups_two_people(monkeypatch):
+    cv2 = pytest.importorskip("cv2")
+    width, height = 640, 480
+    backend_probe = pose_backends.OpenCVBackend.__new__(pose_backends.OpenCVBackend)
+    backend_probe.net_height = 368
+    in_width, in_height = backend_probe.input_size(width, height)
+    assert (in_width, in_height) == (496, 368)   # 4:3 frames are not stretched to a square
+    out_width, out_height = in_width // 8, in_height // 8
+
+    # Two people side by side, keypoints down a zigzag line
+    offsets = np.array([[3 * (k % 2), 4 + 2.5 * k] for k in range(15)])
+    people = [offsets + [12, 0], offsets + [44, 0]]
+    net = FakeNet(mpi_maps(people, out_width, out_height))
+    monkeypatch.setattr(cv2.dnn, "readNet", lambda model, config="": net)
+
+    backend = pose_backends.OpenCVBackend("fake.caffemodel", config_path="fake.prototxt")
+    assert backend.model_pose == "MPI"
+    detected = backend.detect([np.zeros((height, width, 3), np.uint8)] * 2)
+    assert len(detected) == 2
+
+    for found in detected:
+        assert found.shape == (2, 15, 3)
+        found = found[np.argsort(found[:, 0, 0])]
+        for person, cells in zip(found, people):
+            # Output cell centres in frame pixels, within a frame pixel after upsampling, also between cells
+            expected = (cells + 0.5) * [width / out_width, height / out_height]
+            np.testing.assert_allclose(person[:, :2], expected, atol=1.0)
+
+
+def test_pipeline_end_to_end(recording_dir, tmp_path):
+    out_dir = tmp_path / "out"
+    keypoints_3d = str(out_dir / "3d.json")
+    result = run_script("3dconvert.py", recording_dir, "stub", keypoints_3d)
+    assert result.returncode == 0, result.stderr
+
+    with open(keypoints_3d) as f:
+        frames = json.load(f)
+    assert [frame["frame"] for frame in frames] == list(range(NUM_FRAMES))
+    assert frames[0]["model"] == "BODY_135"
+    assert "keypoint_ids" not in frames[1] and "model" not in frames[1]
+    stored_ids = frames[0]["keypoint_ids"]
+    assert len(frames[0]["keypoints_3d"]) == len(stored_ids)
+    depths = [p[2] for frame in frames for p in frame["keypoints_3d"] if p[2] is not None]
+    np.testing.assert_allclose(depths, PLANE_DEPTH / 1000, atol=1e-6)
+
+    # 2D keypoints round trip: same keypoints as the stub produced
+    keypoints_2d = str(out_dir / pose_backends.KEYPOINTS_2D_FILE)
+    saved = pose_backends.ArrayBackend(keypoints_2d)
+    stub = pose_backends.StubBackend("BODY_135")
+    assert saved.num_frames == NUM_FRAMES
+    image = np.zeros((HEIGHT, WIDTH, 3), np.uint8)
+    for expected, found in zip(stub.detect([image] * NUM_FRAMES), saved.detect([None] * NUM_FRAMES)):
+        np.testing.assert_allclose(found, expected, atol=1e-4)
+
+    # Point clouds from the saved keypoints and the depth cache
+    pointcloud_dir = str(tmp_path / "pointcloud")
+    result = run_script("pointcloud.py", recording_dir, keypoints_2d, pointcloud_dir)
+    assert result.returncode == 0, result.stderr
+    with np.load(os.path.join(pointcloud_dir, "pointcloud_00000.npz")) as chunk:
+        assert chunk["first_frame"] == 0 and chunk["num_frames"] == NUM_FRAMES
+        assert chunk["frame"].tolist() == list(range(NUM_FRAMES))
+        points = chunk["points"] * chunk["point_scale"]
+        assert chunk["offsets"][-1] == len(points) > 0
+    np.testing.assert_allclose(points[:, 2], PLANE_DEPTH / 1000, atol=1e-3)
+
+    result = run_script("plotvideo.py", keypoints_3d, str(tmp_path / "plot.html"))
+    assert result.returncode == 0, result.stderr
+    assert os.path.getsize(tmp_path / "plot.html") > 0
+
+    limb_json = str(tmp_path / "limb_distances.json")
+    result = run_script("limbgraph.py", keypoints_3d, limb_json, str(tmp_path / "limb_graph"))
+    assert result.returncode == 0, result.stderr
+    with open(limb_json) as f:
+        limbs = json.load(f)
+    assert len(limbs[0]["limbs"]) == 58
+
+
+def test_empty_keypoints_file(recording_dir, tmp_path):
+    # A keypoints file without frames stops before any detection
+    keypoints_2d = str(tmp_path / "empty.npz")
+    pose_backends.save_keypoints_array(keypoints_2d, [], "BODY_135")
+    result = run_script("pointcloud.py", recording_dir, keypoints_2d, str(tmp_path / "pointcloud"))
+    assert result.returncode == 0, result.stderr
+    assert "of 0 frames" in result.stdout
+
+
+def test_missing_color_source(recording_dir, tmp_path):
+    # Without the bag or color_output.avi the stub backend has no frames to run on
+    no_color_dir = tmp_path / "no_color"
+    no_color_dir.mkdir()
+    for name in (recording.METADATA_FILE, recording.DEPTH_CACHE_DIR):
+        os.symlink(os.path.join(recording_dir, name), no_color_dir / name)
+    result = run_script("3dconvert.py", str(no_color_dir), "stub", str(tmp_path / "out" / "3d.json"))
+    assert result.returncode != 0
+    assert "FileNotFoundError" in result.stderr